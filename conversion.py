@@ -7,6 +7,8 @@ import tempfile
 import re
 import shutil
 import json
+import numpy as np
+from segment_shards import ShardWriter, DEFAULT_SHARD_SIZE
 
 def setup_logging():
     logging.basicConfig(
@@ -75,6 +77,47 @@ def convert_video_to_wav(video_path, temp_dir):
         return None
     
 
+def decode_audio(video_path, sample_rate, channels):
+    command = [
+        "ffmpeg",
+        "-i", video_path,
+        "-vn",
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate),
+        "-ac", str(channels),
+        "pipe:1"
+    ]
+
+    logger.debug(f"Running ffmpeg command: {' '.join(command)}")
+
+    try:
+        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        logger.info(f"Successfully decoded audio from {video_path}")
+        return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffmpeg error while decoding audio from {video_path}: {e.stderr.decode().strip()}")
+        logger.debug(traceback.format_exc())
+        return None
+
+
+def shard_audio(audio, writer, channel, video_id, captions):
+    if not captions:
+        logger.warning(f"No captions provided for sharding {video_id}. Skipping.")
+        return
+
+    for i, entry in enumerate(captions):
+        first = int(round(entry["start_time"] * writer.sample_rate))
+        last = int(round(entry["end_time"] * writer.sample_rate))
+        writer.add(
+            audio[first:last], channel, video_id, i + 1, entry.get("text", ""),
+            speaker=entry.get("speaker", ""),
+            start_time=entry["start_time"],
+            end_time=entry["end_time"]
+        )
+    logger.info(f"Added {len(captions)} segments from {video_id} to shards")
+
+
 def time_str_to_seconds(time_str):
     parts = time_str.strip().split(':')
     parts = [float(part) for part in parts]
@@ -89,21 +132,48 @@ def time_str_to_seconds(time_str):
         return 0.0
 
 
-def process_annotation_file(anno_path):
+def load_captions(anno_path):
 
-    segments = []
+    captions = []
     if os.path.exists(anno_path):
         try:
             with open(anno_path, 'r') as json_file:
                 anno_data = json.load(json_file)  # Load JSON data
                 for entry in anno_data:
                     if "start_time" in entry and "end_time" in entry:
-                        segments.append((entry["start_time"], entry["end_time"]))
+                        captions.append(entry)
         except json.JSONDecodeError:
             logger.error(f"Failed to parse annotation file {anno_path}")
     else:
         logger.warning(f"Annotation file does not exist: {anno_path}")
-    return segments
+    return captions
+
+
+def process_annotation_file(anno_path):
+    return [(entry["start_time"], entry["end_time"]) for entry in load_captions(anno_path)]
+
+
+def find_videos(base_dir, anno_dir):
+    for root, _, files in os.walk(base_dir):
+        if root == base_dir:
+            continue
+
+        channel = os.path.basename(root)
+        for file in files:
+            if file.lower().endswith((".mp4", ".mov", ".avi", ".mkv")) and not file.endswith(".temp.mp4"):
+                video_path = os.path.join(root, file)
+                logger.info(f"Processing video file: {video_path}")
+
+                video_id = os.path.splitext(file)[0]
+                anno_filename = f"{video_id}.json"
+                anno_path = os.path.join(anno_dir, channel)
+                anno_path = os.path.join(anno_path, anno_filename)
+
+                if not os.path.exists(anno_path):
+                    logger.warning(f"Skipping {video_path}: Annotation file {anno_path} does not exist")
+                    continue
+
+                yield video_path, channel, video_id, anno_path
 
 
 def main(base_dir, anno_dir, output_dir):
@@ -111,41 +181,22 @@ def main(base_dir, anno_dir, output_dir):
     logger.info(f"Created temporary directory for WAV conversions: {temp_dir}")
 
     try:
-        for root, _, files in os.walk(base_dir):
-            if root == base_dir:
+        for video_path, channel, video_id, anno_path in find_videos(base_dir, anno_dir):
+            wav_path = convert_video_to_wav(video_path, temp_dir)
+            if not wav_path:
+                logger.error(f"Failed to convert {video_path} to WAV. Skipping.")
                 continue
 
-            channel = os.path.basename(root)
-            for file in files:
-                if file.lower().endswith((".mp4", ".mov", ".avi", ".mkv")) and not file.endswith(".temp.mp4"):
-                    video_path = os.path.join(root, file)
-                    logger.info(f"Processing video file: {video_path}")
-
-                    video_id = os.path.splitext(file)[0]
-                    anno_filename = f"{video_id}.json"
-                    channel_dir = os.path.basename(os.path.dirname(video_path))
-                    anno_path = os.path.join(anno_dir, channel_dir)
-                    anno_path = os.path.join(anno_path, anno_filename)
-
-                    if not os.path.exists(anno_path):
-                        logger.warning(f"Skipping {video_path}: Annotation file {anno_path} does not exist")
-                        continue
-
-                    wav_path = convert_video_to_wav(video_path, temp_dir)
-                    if not wav_path:
-                        logger.error(f"Failed to convert {video_path} to WAV. Skipping.")
-                        continue
-
-                    segments = process_annotation_file(anno_path)
-                    if not segments:
-                        logger.warning(f"No valid segments found in {anno_path}. Skipping.")
-                        continue
+            segments = process_annotation_file(anno_path)
+            if not segments:
+                logger.warning(f"No valid segments found in {anno_path}. Skipping.")
+                continue
 
-                    final_output_dir = os.path.join(output_dir, channel)
-                    os.makedirs(final_output_dir, exist_ok=True)
-                    logger.info(f"Output directory for segments: {final_output_dir}")
+            final_output_dir = os.path.join(output_dir, channel)
+            os.makedirs(final_output_dir, exist_ok=True)
+            logger.info(f"Output directory for segments: {final_output_dir}")
 
-                    splice_audio(wav_path, final_output_dir, video_id, segments)
+            splice_audio(wav_path, final_output_dir, video_id, segments)
 
     finally:
         if os.path.exists(temp_dir):
@@ -153,12 +204,40 @@ def main(base_dir, anno_dir, output_dir):
         logger.info(f"Deleted temporary directory: {temp_dir}")
 
 
+def main_shards(base_dir, anno_dir, output_dir, sample_rate, channels, shard_size):
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        logger.error(f"Shard output directory is not empty: {output_dir}. Aborting.")
+        return
+
+    logger.info(f"Writing segment shards to: {output_dir}")
+    with ShardWriter(output_dir, sample_rate, channels, shard_size) as writer:
+        for video_path, channel, video_id, anno_path in find_videos(base_dir, anno_dir):
+            captions = load_captions(anno_path)
+            if not captions:
+                logger.warning(f"No valid segments found in {anno_path}. Skipping.")
+                continue
+
+            audio = decode_audio(video_path, sample_rate, channels)
+            if audio is None:
+                logger.error(f"Failed to decode audio from {video_path}. Skipping.")
+                continue
+
+            shard_audio(audio, writer, channel, video_id, captions)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert videos to WAV and splice based on timestamps')
     parser.add_argument('--base_dir', type=str, help='Parent directory containing video files to process')
     parser.add_argument('--anno_dir', type=str, help='Parent directory containing annotation files')
     parser.add_argument('--output_dir', type=str, help='Directory to save spliced WAV files')
+    parser.add_argument('--shards', action='store_true', help='Pack segments into PCM shard files with an index instead of one WAV per caption')
+    parser.add_argument('--sample_rate', type=int, default=16000, help='Sample rate of sharded audio (default=16000)')
+    parser.add_argument('--channels', type=int, default=1, help='Number of channels of sharded audio (default=1)')
+    parser.add_argument('--shard_size', type=int, default=DEFAULT_SHARD_SIZE, help=f'Maximum bytes of audio per shard (default={DEFAULT_SHARD_SIZE})')
 
     args = parser.parse_args()
 
-    main(args.base_dir, args.anno_dir, args.output_dir)
\ No newline at end of file
+    if args.shards:
+        main_shards(args.base_dir, args.anno_dir, args.output_dir, args.sample_rate, args.channels, args.shard_size)
+    else:
+        main(args.base_dir, args.anno_dir, args.output_dir)
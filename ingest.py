@@ -0,0 +1,327 @@
+import subprocess
+import os
+import argparse
+import json
+import logging
+import threading
+import traceback
+import wave
+import numpy as np
+from paddleocr import PaddleOCR
+from ocr import ocr_frame, caption_keys
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # pcm_s16le
+READ_CHUNK = 1 << 16
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    logger = logging.getLogger('Ingestion')
+    return logger
+
+logger = setup_logging()
+
+
+class PcmBuffer:
+    """In-memory PCM audio decoded alongside the video frames.
+
+    Audio that no caption can still need is discarded with `discard_before`,
+    so the buffer only holds the window around the captions being read.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.sample_rate = sample_rate
+        self.frame_bytes = channels * SAMPLE_WIDTH
+        self.data = bytearray()
+        self.offset = 0  # audio frames already discarded from the front
+        self.lock = threading.Lock()
+
+    def write(self, chunk):
+        with self.lock:
+            self.data.extend(chunk)
+
+    def end_time(self):
+        with self.lock:
+            return (self.offset + len(self.data) // self.frame_bytes) / self.sample_rate
+
+    def slice(self, start, end):
+        with self.lock:
+            first = max(int(round(start * self.sample_rate)) - self.offset, 0)
+            last = max(int(round(end * self.sample_rate)) - self.offset, first)
+            return bytes(self.data[first * self.frame_bytes:last * self.frame_bytes])
+
+    def discard_before(self, time):
+        with self.lock:
+            drop = min(int(time * self.sample_rate) - self.offset, len(self.data) // self.frame_bytes)
+            if drop > 0:
+                del self.data[:drop * self.frame_bytes]
+                self.offset += drop
+
+
+def _ffprobe(video_path, stream, entries):
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", stream,
+        "-show_entries", entries,
+        "-of", "json",
+        video_path
+    ]
+
+    logger.debug(f"Running ffprobe command: {' '.join(command)}")
+
+    try:
+        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffprobe error while reading {video_path}: {e.stderr.decode().strip()}")
+        return None
+    return json.loads(result.stdout).get("streams", [])
+
+
+def probe_video(video_path):
+    streams = _ffprobe(video_path, "v:0", "stream=width,height,avg_frame_rate,r_frame_rate:stream_tags=rotate:stream_side_data=rotation")
+    if not streams:
+        logger.error(f"No video stream found in {video_path}")
+        return None
+
+    stream = streams[0]
+    fps = 0.0
+    for key in ("avg_frame_rate", "r_frame_rate"):
+        num, _, den = stream.get(key, "0/0").partition('/')
+        if float(den or 1) > 0 and float(num) > 0:
+            fps = float(num) / float(den or 1)
+            break
+
+    # ffmpeg auto-rotates, so frames arrive in display orientation
+    width, height = stream["width"], stream["height"]
+    rotation = stream.get("tags", {}).get("rotate", 0)
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    if int(float(rotation)) % 180 != 0:
+        width, height = height, width
+
+    audio_streams = _ffprobe(video_path, "a", "stream=index")
+    has_audio = bool(audio_streams)
+    return width, height, fps, has_audio
+
+
+def _drain(stream, sink):
+    for chunk in iter(lambda: stream.read(READ_CHUNK), b''):
+        sink(chunk)
+    stream.close()
+
+
+def ingest_video(video_path, anno_data, reader, hand, segment_dir, video_id):
+    """Demux a video once, OCR its captions and write the matching audio segments.
+
+    ffmpeg decodes the video stream to raw BGR frames on stdout and the audio
+    stream to PCM on a second pipe. Each caption's audio is written to
+    `segment_dir` as soon as its text is finalized and the audio up to its end
+    has been decoded, then renamed to `{video_id}_{i}.wav` once the captions
+    are sorted. Videos without audio still get their captions.
+
+    Returns the captions sorted by start time.
+    """
+    start, end = caption_keys(hand)
+    written = []
+    try:
+        logging.getLogger('ppocr').setLevel(logging.ERROR)
+
+        probe = probe_video(video_path)
+        if probe is None:
+            return []
+        width, height, fps, has_audio = probe
+        if fps <= 0:
+            logger.error(f"Invalid FPS value for video file: {video_path}")
+            return []
+        if not has_audio:
+            logger.warning(f"No audio stream in {video_path}, extracting captions only")
+
+        logger.info(f"Processing video: {video_path} at {fps} FPS")
+
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-i", video_path,
+            "-map", "0:v:0",
+            "-vsync", "0",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "pipe:1"
+        ]
+        pass_fds = ()
+        if has_audio:
+            audio_read, audio_write = os.pipe()
+            pass_fds = (audio_write,)
+            command += [
+                "-map", "0:a:0",
+                "-f", "s16le",
+                "-acodec", "pcm_s16le",
+                "-ar", str(SAMPLE_RATE),
+                "-ac", str(CHANNELS),
+                f"pipe:{audio_write}"
+            ]
+
+        logger.debug(f"Running ffmpeg command: {' '.join(command)}")
+
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=pass_fds)
+        finally:
+            if has_audio:
+                os.close(audio_write)
+
+        audio = PcmBuffer() if has_audio else None
+        errors = []
+        threads = [threading.Thread(target=_drain, args=(process.stderr, errors.append), daemon=True)]
+        if has_audio:
+            threads.append(threading.Thread(target=_drain, args=(os.fdopen(audio_read, 'rb'), audio.write), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        frame_size = width * height * 3
+        frame_index = 0
+        processed_entries = set()
+        pending = []
+        captions = []
+
+        def emit_ready(flush=False):
+            decoded = audio.end_time()
+            for index, caption in list(pending):
+                if flush or caption["end_time"] <= decoded:
+                    temp_file = os.path.join(segment_dir, f"{video_id}.anno_{index}.wav.part")
+                    write_segment(temp_file, audio.slice(caption["start_time"], caption["end_time"]))
+                    written.append((caption, temp_file))
+                    pending.remove((index, caption))
+
+        finished = False
+        try:
+            while True:
+                raw = process.stdout.read(frame_size)
+                if len(raw) < frame_size:
+                    break
+                frame = np.frombuffer(raw, dtype=np.uint8).reshape((height, width, 3))
+
+                frame_index += 1
+                start_time = frame_index / fps
+                end_time = (frame_index + 1) / fps
+
+                before = set(processed_entries)
+                finalized = ocr_frame(frame, start_time, end_time, anno_data, processed_entries, reader, hand)
+                captions.extend(finalized)
+                if audio is None:
+                    continue
+                pending.extend(zip(sorted(processed_entries - before), finalized))
+                emit_ready()
+
+                # Keep only the audio that pending or still-open captions can use
+                needed = [c["start_time"] for _, c in pending]
+                needed += [
+                    entry["start"] for i, entry in enumerate(anno_data)
+                    if i not in processed_entries and start in entry and end in entry and entry[end] > start_time
+                ]
+                audio.discard_before(min(needed, default=start_time))
+            finished = True
+        finally:
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            for thread in threads:
+                thread.join()
+
+        if process.returncode != 0:
+            logger.error(f"ffmpeg error while ingesting {video_path}: {b''.join(errors).decode().strip()}")
+            for _, temp_file in written:
+                os.remove(temp_file)
+            return []
+
+        if audio is not None:
+            emit_ready(flush=True)
+
+        captions.sort(key=lambda x: x["start_time"])
+        temp_files = {id(caption): temp_file for caption, temp_file in written}
+        for i, caption in enumerate(captions):
+            if id(caption) in temp_files:
+                os.replace(temp_files[id(caption)], os.path.join(segment_dir, f"{video_id}_{i + 1}.wav"))
+        logger.info(f"Finished processing video: {video_path}")
+        return captions
+
+    except Exception as e:
+        logger.error(f"Error processing file {video_path}: {str(e)}")
+        logger.debug(traceback.format_exc())
+        for _, temp_file in written:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        return []
+
+
+def write_segment(output_file, pcm):
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with wave.open(output_file, 'wb') as wav_file:
+        wav_file.setnchannels(CHANNELS)
+        wav_file.setsampwidth(SAMPLE_WIDTH)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm)
+    logger.info(f"Generated segment: {output_file}")
+
+
+def main(base_dir, anno_dir, output_dir, segment_dir, hand):
+    reader = PaddleOCR()
+    segment_dir = segment_dir or output_dir
+
+    logger.info(f"Starting ingestion in base directory: {base_dir}")
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if file.endswith(".mp4") and not file.endswith(".temp.mp4"):
+                file_path = os.path.join(root, file)
+                logger.info(f"Processing file: {file_path}")
+
+                video_id = os.path.splitext(file)[0]
+                anno_path = os.path.join(anno_dir, f"{video_id}.json")
+                if not os.path.exists(anno_path):
+                    logger.warning(f"No annotation file found for {file_path}")
+                    continue
+
+                try:
+                    with open(anno_path, 'r') as json_file:
+                        anno_data = json.load(json_file)
+                except json.JSONDecodeError:
+                    logger.error(f"Failed to parse annotation file {anno_path}")
+                    continue
+
+                channel_dir = os.path.basename(os.path.dirname(file_path))
+                final_segment_dir = os.path.join(segment_dir, channel_dir)
+                captions = ingest_video(file_path, anno_data, reader, hand, final_segment_dir, video_id)
+                if not captions:
+                    logger.warning(f"Skipping file, no output generated: {file_path}")
+                    continue
+
+                final_output_dir = os.path.join(output_dir, channel_dir)
+                os.makedirs(final_output_dir, exist_ok=True)
+
+                output_file_path = os.path.join(final_output_dir, video_id + '.json')
+                try:
+                    with open(output_file_path, 'w') as outfile:
+                        json.dump(captions, outfile, indent=4)
+                    logger.info(f"Saved OCR captions to: {output_file_path}")
+                except Exception as e:
+                    logger.error(f"Failed to write output file {output_file_path}: {str(e)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Single-pass ingestion - caption extraction and audio segments from one decode')
+    parser.add_argument('--video_dir', type=str, help='Directory containing videos')
+    parser.add_argument('--hand', action='store_true', help='Whether or not the annotations contain hand corrections')
+    parser.add_argument('--anno_dir', type=str, default='annotations', help='Directory containing JSON annotations (default=annotations)')
+    parser.add_argument('--output_dir', type=str, help='Directory to save the transcripts')
+    parser.add_argument('--segment_dir', type=str, default=None, help='Directory to save audio segments (default=output_dir)')
+
+    args = parser.parse_args()
+    main(args.video_dir, args.anno_dir, args.output_dir, args.segment_dir, args.hand)
@@ -57,7 +57,7 @@ def normalize_chars(text):
     text = re.sub(r'[^a-zA-Z0-9\s.,!?\'"-]', '', text)  # remove stray junk chars
     return text
 
-def clean_caption_text(text, hand==False):
+def clean_caption_text(text, hand=False):
     text = remove_before_colon(text)
     text = remove_text_between_symbols(text)
     text = replace_bleeped_curse_words(text)
@@ -88,13 +88,40 @@ def extract_text_paddle(frame, ocr_reader):
     return None
 
 
-def ocr_captions(video_path, anno_data, reader, hand):
+def caption_keys(hand):
     if hand:
-        start = "start_frame"
-        end = "end_frame"
-    else:
-        start = "start"
-        end = "end"
+        return "start_frame", "end_frame"
+    return "start", "end"
+
+
+def ocr_frame(frame, start_time, end_time, anno_data, processed_entries, reader, hand):
+    start, end = caption_keys(hand)
+    finalized = []
+    for i, entry in enumerate(anno_data):
+        if i in processed_entries:
+            continue
+
+        if start in entry and end in entry:
+            if has_overlap(start_time, end_time, entry[start], entry[end]):
+                height, _, _ = frame.shape
+                crop = int(2 * height / 3)
+                cropped_frame = frame[crop:]
+
+                caption = extract_text_paddle(cropped_frame, reader)
+                if caption:
+                    entry_data = {
+                        "start_time": entry["start"],
+                        "end_time": entry["end"],
+                        "text": apply_replacements(entry, caption) if 'to_replace' in entry else clean_caption_text(caption, hand),
+                        "speaker": entry["speaker"] if 'speaker' in entry else ""
+                   }
+                    print(entry_data)
+                    finalized.append(entry_data)
+                    processed_entries.add(i)
+    return finalized
+
+
+def ocr_captions(video_path, anno_data, reader, hand):
     try:
         logger = logging.getLogger('ppocr')
         logger.setLevel(logging.ERROR)
@@ -124,27 +151,7 @@ def ocr_captions(video_path, anno_data, reader, hand):
             start_time = frame_count / fps
             end_time = (frame_count + 1) / fps
 
-            for i, entry in enumerate(anno_data):
-                if i in processed_entries:
-                    continue
-
-                if start in entry and end in entry:
-                    if has_overlap(start_time, end_time, entry[start], entry[end]):
-                        height, _, _ = frame.shape
-                        crop = int(2 * height / 3)
-                        cropped_frame = frame[crop:]
-
-                        caption = extract_text_paddle(cropped_frame, reader)
-                        if caption:
-                            entry_data = {
-                                "start_time": entry["start"],
-                                "end_time": entry["end"],
-                                "text": apply_replacements(entry, caption) if 'to_replace' in entry else clean_caption_text(caption, hand),
-                                "speaker": entry["speaker"] if 'speaker' in entry else ""
-                           }
-                            print(entry_data)
-                            video_data.append(entry_data)
-                            processed_entries.add(i)
+            video_data.extend(ocr_frame(frame, start_time, end_time, anno_data, processed_entries, reader, hand))
 
         video_capture.release()
         video_data.sort(key=lambda x: x["start_time"])
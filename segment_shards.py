@@ -0,0 +1,176 @@
+import os
+import json
+import random
+import numpy as np
+
+MANIFEST = "manifest.json"
+DTYPE = "int16"
+DEFAULT_SHARD_SIZE = 1 << 30  # bytes of PCM per shard
+
+# Layout of a shard directory:
+#   manifest.json       sample rate, channels, dtype and the ordered list of shards
+#   shard_00000.pcm     contiguous PCM for every segment in the shard
+#   shard_00000.json    one record per segment: offset and length (in audio frames)
+#                       into the .pcm file, plus channel, video_id, segment number and text
+#
+# Shards are written under a .part suffix and renamed once complete; the manifest
+# is written last, so an interrupted export has no manifest and cannot be opened.
+
+
+class ShardWriter:
+    """Packs audio segments into large PCM shards with a JSON index."""
+
+    def __init__(self, shard_dir, sample_rate, channels, shard_size=DEFAULT_SHARD_SIZE):
+        self.shard_dir = shard_dir
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.shard_size = shard_size
+        self.shards = []
+        self.pcm_file = None
+        self.records = []
+        self.offset = 0
+        os.makedirs(shard_dir, exist_ok=True)
+        if os.listdir(shard_dir):
+            raise FileExistsError(f"Shard directory is not empty: {shard_dir}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self.pcm_file is not None:
+            # Leave the partial shard as .part and write no manifest
+            self.pcm_file.close()
+            self.pcm_file = None
+
+    def _open_shard(self):
+        name = f"shard_{len(self.shards):05d}"
+        self.shards.append(name)
+        self.pcm_file = open(os.path.join(self.shard_dir, name + ".pcm.part"), 'wb')
+        self.records = []
+        self.offset = 0
+
+    def _close_shard(self):
+        if self.pcm_file is None:
+            return
+        self.pcm_file.close()
+        self.pcm_file = None
+        path = os.path.join(self.shard_dir, self.shards[-1])
+        with open(path + ".json.part", 'w') as index_file:
+            json.dump(self.records, index_file)
+        os.replace(path + ".pcm.part", path + ".pcm")
+        os.replace(path + ".json.part", path + ".json")
+
+    def add(self, audio, channel, video_id, segment, text, **fields):
+        """Append one segment. `audio` is int16 PCM, shaped (frames,) or (frames, channels)."""
+        audio = np.ascontiguousarray(audio, dtype=DTYPE)
+        length = len(audio) if audio.ndim > 1 else len(audio) // self.channels
+        if self.pcm_file is None:
+            self._open_shard()
+        elif self.offset and (self.offset + length) * self.channels * audio.itemsize > self.shard_size:
+            self._close_shard()
+            self._open_shard()
+
+        self.pcm_file.write(audio.tobytes())
+        record = {"channel": channel, "video_id": video_id, "segment": segment, "offset": self.offset, "length": length, "text": text}
+        record.update(fields)
+        self.records.append(record)
+        self.offset += length
+
+    def close(self):
+        self._close_shard()
+        manifest = {
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "dtype": DTYPE,
+            "shards": self.shards
+        }
+        path = os.path.join(self.shard_dir, MANIFEST)
+        with open(path + ".part", 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(path + ".part", path)
+
+
+class SegmentShards:
+    """Random access to a shard directory written by ShardWriter.
+
+    Indexing returns (audio, record), where audio is a read-only view into the
+    memory-mapped shard, shaped (frames,) for mono or (frames, channels).
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, MANIFEST), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        self.sample_rate = manifest["sample_rate"]
+        self.channels = manifest["channels"]
+        self.dtype = np.dtype(manifest["dtype"])
+        self.shards = manifest["shards"]
+
+        self.records = []
+        self.by_shard = []
+        for shard_id, name in enumerate(self.shards):
+            with open(os.path.join(shard_dir, name + ".json"), 'r') as index_file:
+                records = json.load(index_file)
+            self.by_shard.append(range(len(self.records), len(self.records) + len(records)))
+            self.records.extend((shard_id, record) for record in records)
+        self.keys = {}
+        for i, (_, record) in enumerate(self.records):
+            key = (record["channel"], record["video_id"], record["segment"])
+            if key in self.keys:
+                raise ValueError(f"Duplicate segment {key} in {shard_dir}")
+            self.keys[key] = i
+        self.maps = [None] * len(self.shards)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _shard(self, shard_id):
+        if self.maps[shard_id] is None:
+            path = os.path.join(self.shard_dir, self.shards[shard_id] + ".pcm")
+            if os.path.getsize(path) == 0:
+                pcm = np.zeros((0, self.channels), dtype=self.dtype)
+            else:
+                pcm = np.memmap(path, dtype=self.dtype, mode='r').reshape(-1, self.channels)
+            self.maps[shard_id] = pcm[:, 0] if self.channels == 1 else pcm
+        return self.maps[shard_id]
+
+    def __getitem__(self, i):
+        shard_id, record = self.records[i]
+        audio = self._shard(shard_id)[record["offset"]:record["offset"] + record["length"]]
+        return audio, record
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get(self, channel, video_id, segment):
+        """Look up a segment by channel, video id and 1-based segment number, as in `{channel}/{video_id}_{segment}.wav`."""
+        return self[self.keys[(channel, video_id, segment)]]
+
+    def shuffled(self, seed=None, shards_at_once=None):
+        """Iterate in random order.
+
+        By default this is a full permutation of all segments. Segments are
+        written video by video, so a shard holds long runs of consecutive
+        videos; any shard-local order keeps those runs together. Passing
+        `shards_at_once=k` instead interleaves segments from k randomly chosen
+        shards at a time, trading randomness for fewer shards being paged in
+        at once when the data does not fit in memory.
+        """
+        rng = random.Random(seed)
+        if shards_at_once is None:
+            order = list(range(len(self)))
+            rng.shuffle(order)
+            for i in order:
+                yield self[i]
+            return
+
+        shard_order = list(range(len(self.shards)))
+        rng.shuffle(shard_order)
+        for group in range(0, len(shard_order), shards_at_once):
+            order = [i for shard_id in shard_order[group:group + shards_at_once] for i in self.by_shard[shard_id]]
+            rng.shuffle(order)
+            for i in order:
+                yield self[i]
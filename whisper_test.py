@@ -5,6 +5,8 @@ import os
 from whisper.normalizers import EnglishTextNormalizer
 import random
 import tqdm
+import numpy as np
+from segment_shards import SegmentShards, MANIFEST
 
 normalizer = EnglishTextNormalizer()
 model = whisper.load_model("turbo")
@@ -12,6 +14,10 @@ model = whisper.load_model("turbo")
 # print(result["text"])
 
 def test_all(segment_dir, anno_dir):
+    # segment_dir may also be a shard directory written by conversion.py --shards
+    shards = None
+    if os.path.exists(os.path.join(segment_dir, MANIFEST)):
+        shards = SegmentShards(segment_dir)
     for root, _, files in os.walk(anno_dir):
         for file in files:
             # Find and load annotations files
@@ -21,11 +27,20 @@ def test_all(segment_dir, anno_dir):
                 channel_dir = os.path.basename(root)
                 segment_channel_dir = os.path.join(segment_dir, channel_dir)
                 try:
-                    test_one(segment_channel_dir, anno_path)
+                    test_one(segment_channel_dir, anno_path, shards)
                 except Exception as e:
                     print(f"Error reading segments for {anno_path}: {str(e)}")
 
-def test_one(segment_channel_dir, anno_path):
+def shard_audio_for_whisper(shards, channel, video_id, segment):
+    if shards.sample_rate != whisper.audio.SAMPLE_RATE:
+        raise ValueError(f"Shards are {shards.sample_rate} Hz, whisper expects {whisper.audio.SAMPLE_RATE} Hz")
+    audio, _ = shards.get(channel, video_id, segment)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    return audio.astype(np.float32) / 32768.0
+
+
+def test_one(segment_channel_dir, anno_path, shards=None):
     gold = []
     transcribed = []
 
@@ -35,8 +50,12 @@ def test_one(segment_channel_dir, anno_path):
 
         print("Processing", anno_path)
         for i,anno in tqdm.tqdm(enumerate(annotations)):
-            segment_file = os.path.join(segment_channel_dir,  video_id + "_" + str(i + 1) + ".wav")
-            result = model.transcribe(segment_file)
+            if shards is not None:
+                channel = os.path.basename(os.path.normpath(segment_channel_dir))
+                result = model.transcribe(shard_audio_for_whisper(shards, channel, video_id, i + 1))
+            else:
+                segment_file = os.path.join(segment_channel_dir,  video_id + "_" + str(i + 1) + ".wav")
+                result = model.transcribe(segment_file)
             gold.append(normalizer(anno["text"]))
             transcribed.append(normalizer(result["text"]))
         curr_wer = wer(gold, transcribed)